@@ -1,72 +1,276 @@
-import requests
+import aiohttp
+import asyncio
 import os
 import re
 import argparse
-from lxml import html
-from markdownify import markdownify
-import time
+import functools
+import logging
+import logging.handlers
+import sys
+from lxml import etree, html
+from markdownify import MarkdownConverter
 import random
+import time
+import sqlite3
+import multiprocessing
+from email.utils import formatdate, parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
 
 BASE_URL = "https://beforeiplay.com"
 INDEX_URL = f"{BASE_URL}/index.php?title=Category:Games"
+# Accept-Encoding is left to aiohttp: it advertises br only when Brotli is installed to decode it
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
+# Transient failures worth retrying, with exponential backoff (0.5s, 1s, 2s),
+# or as long as the server's Retry-After asks, up to MAX_BACKOFF
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+
+# Pages are read in chunks and abandoned past this size, bounding memory per worker
+MAX_PAGE_BYTES = 4 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+# Returned by fetch_html in place of a tree when the server answers 304 Not Modified
+NOT_MODIFIED = object()
+
+# Record of saved pages, kept inside the output directory
+MANIFEST_FILENAME = '.manifest.sqlite'
+# Single-file output for --format sqlite, also inside the output directory
+PAGE_STORE_FILENAME = 'games.sqlite'
+
+# Windows and macOS file systems ignore case by default: "DOOM.md" and "Doom.md" are one file
+CASE_INSENSITIVE_FS = sys.platform in ('win32', 'darwin')
+
+# XPath expressions are compiled once at import instead of on every page
+_XP_TITLE = etree.XPath('//h1[@id="firstHeading"]/span/text()')
+_XP_CONTENT = etree.XPath('//div[@id="mw-content-text"]/div[contains(@class, "mw-parser-output")]')
+_XP_CONTENT_FALLBACK = etree.XPath('//div[@id="mw-content-text"]')
+# Page chrome inside the content area that should not end up in the Markdown
+_XP_NON_CONTENT = etree.XPath(
+    './/script | .//style'
+    ' | .//*[contains(@class, "editsection")]'
+    ' | .//*[contains(concat(" ", normalize-space(@class), " "), " toc ")]'
+    ' | .//div[@class="printfooter"]'
+)
+
+# Characters Windows does not allow in filenames, deleted in one str.translate pass
+_TRANS_TABLE = str.maketrans({c: None for c in '<>:"/\\|?*'})
+_DOTDOT = re.compile(r'\.\.')
+
+# Category subdirectory for each ASCII code point: '0-9', 'A'..'Z' (either case) or '_'
+_BUCKET = ['_'] * 128
+for i in range(ord('0'), ord('9') + 1):
+    _BUCKET[i] = '0-9'
+for i in range(ord('A'), ord('Z') + 1):
+    _BUCKET[i] = chr(i)
+for i in range(ord('a'), ord('z') + 1):
+    _BUCKET[i] = chr(i - 32)
+del i
+
+# One converter per process, configured once, instead of one per page
+_MD = MarkdownConverter(heading_style="ATX")
+
+class TokenBucket:
+    """Rate limiter shared by all workers: `rate` requests per second, bursts of up to `burst`.
+
+    Waiters are served in arrival order. With `jitter`, each wait for a token is
+    randomly stretched or shortened by up to 50%, so under load requests are
+    0.5x-1.5x the nominal interval apart and the average rate still holds.
+    """
 
-def fetch_html(url):
-    """Fetches HTML content from a URL and returns a parsed lxml tree."""
+    def __init__(self, rate, burst, jitter=False):
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                if self.jitter:
+                    wait *= random.uniform(0.5, 1.5)
+                await asyncio.sleep(wait)
+                # Grant as if exactly the missing credit had accrued, whether the
+                # jittered wait ran short or long; the next wait starts from zero
+                self._tokens = 1.0
+                self._updated = time.monotonic()
+            self._tokens -= 1
+
+def _retry_after_seconds(value):
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
     try:
-        response = requests.get(url, headers=HEADERS, timeout=30)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-        # Explicitly decode using UTF-8, common for web pages
-        response.encoding = 'utf-8'
-        tree = html.fromstring(response.text)
-        return tree
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching {url}: {e}")
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
         return None
+
+async def _get_with_retries(session, url, read_response, headers=None, rate_limiter=None):
+    """GETs a URL, retrying transient failures, and returns `await read_response(response)`.
+
+    read_response is called once per successful attempt (2xx/3xx), so any state
+    it builds from the body starts fresh on a retry. Every attempt first takes
+    a token from `rate_limiter`, if given.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                    retry_reason = f"HTTP {response.status}"
+                    retry_after = _retry_after_seconds(response.headers.get('Retry-After'))
+                else:
+                    response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+                    return await read_response(response)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            retry_reason = str(e) or type(e).__name__
+
+        backoff = min(max(RETRY_BACKOFF * (2 ** attempt), retry_after or 0), MAX_BACKOFF)
+        logger.warning(f"Retrying {url} in {backoff:.1f}s ({retry_reason})...")
+        await asyncio.sleep(backoff)
+
+async def _read_page(response):
+    """Reads a page body, returning (content, charset, headers) or (NOT_MODIFIED, None, None) on a 304.
+
+    Raises ValueError if the body exceeds MAX_PAGE_BYTES.
+    """
+    if response.status == 304:
+        return NOT_MODIFIED, None, None
+    if response.content_length is not None and response.content_length > MAX_PAGE_BYTES:
+        raise ValueError(f"page too large ({response.content_length} bytes)")
+    # Keep the raw bytes; lxml decodes them itself using the charset passed back here
+    content = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+        content.extend(chunk)
+        if len(content) > MAX_PAGE_BYTES:
+            raise ValueError(f"page too large (over {MAX_PAGE_BYTES} bytes)")
+    return bytes(content), response.charset, response.headers
+
+async def fetch_html(session, url, if_modified_since=None, if_none_match=None, rate_limiter=None):
+    """Fetches HTML content from a URL and returns a parsed lxml tree.
+
+    Returns:
+        tuple: (tree, headers) where tree is None on error or NOT_MODIFIED if the
+        page has not changed since `if_modified_since` (an HTTP-date) or still
+        matches the `if_none_match` ETag, and headers are the response headers
+        (None unless a page was parsed).
+    """
+    request_headers = {}
+    if if_modified_since:
+        request_headers['If-Modified-Since'] = if_modified_since
+    if if_none_match:
+        request_headers['If-None-Match'] = if_none_match
+    try:
+        content, charset, response_headers = await _get_with_retries(session, url, _read_page, request_headers or None, rate_limiter)
+        if content is NOT_MODIFIED:
+            return NOT_MODIFIED, None
+
+        # Parsing is blocking C work; run it on the worker threads, not the event loop
+        # Decode as the server's charset, falling back to UTF-8 (not lxml's Latin-1 default)
+        parser = html.HTMLParser(encoding=charset or 'utf-8')
+        tree = await asyncio.to_thread(html.fromstring, content, base_url=url, parser=parser)
+        return tree, response_headers
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Error fetching {url}: {e}")
+        return None, None
+    except ValueError as e: # Body over MAX_PAGE_BYTES
+        logger.error(f"Error reading {url}: {e}")
+        return None, None
     except Exception as e:
-        print(f"Error parsing HTML from {url}: {e}")
-        return None
+        logger.error(f"Error parsing HTML from {url}: {e}")
+        return None, None
 
-def get_game_links(index_url, limit=None):
-    """Extracts game page links from the index URL."""
-    print(f"Fetching game index from: {index_url}")
-    tree = fetch_html(index_url)
-    if tree is None:
-        return []
+async def _stream_game_links(response):
+    """Pull-parses the index page as it arrives and collects the game links.
 
-    # Select anchor tags within list items in the specified div
-    # //div[@class="mw-category-group"]//li/a
+    Equivalent to the XPath //div[@class="mw-category-group"]//li/a, but
+    elements are cleared once handled so the full DOM is never held.
+    """
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding=response.charset)
+    game_links = []
+    group_depth = 0 # Nesting depth of <div>s inside a category group, 0 when outside
+
+    def handle_events():
+        nonlocal group_depth
+        for event, el in parser.read_events():
+            if el.tag == 'div':
+                if event == 'start':
+                    if group_depth or el.get('class') == 'mw-category-group':
+                        group_depth += 1
+                elif group_depth:
+                    group_depth -= 1
+                    if not group_depth:
+                        el.clear(keep_tail=True)
+            elif event == 'end' and group_depth:
+                if el.tag == 'a' and el.getparent() is not None and el.getparent().tag == 'li':
+                    href = el.get('href')
+                    title = ''.join(el.itertext()) # Get title for progress display
+                    if href:
+                        game_links.append({"url": BASE_URL + href, "title": title})
+                elif el.tag == 'li':
+                    # Drop the finished item and everything before it
+                    el.clear(keep_tail=True)
+                    while el.getprevious() is not None:
+                        del el.getparent()[0]
+
+    async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+        parser.feed(chunk)
+        handle_events()
+    parser.close()
+    handle_events()
+    return game_links
+
+async def get_game_links(session, index_url, limit=None, rate_limiter=None):
+    """Extracts game page links from the index URL."""
+    logger.info(f"Fetching game index from: {index_url}")
     try:
-        link_elements = tree.xpath('//div[@class="mw-category-group"]//li/a')
-        game_links = []
-        for link in link_elements:
-            href = link.get('href')
-            title = link.text_content() # Get title for progress display
-            if href:
-                full_url = BASE_URL + href
-                game_links.append({"url": full_url, "title": title})
-
-        print(f"Found {len(game_links)} potential game links.")
-
-        if limit:
-            print(f"Limiting to {limit} games.")
-            return game_links[:limit]
-        return game_links
+        game_links = await _get_with_retries(session, index_url, _stream_game_links, rate_limiter=rate_limiter)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Error fetching {index_url}: {e}")
+        return []
     except Exception as e:
-        print(f"Error extracting links using XPath: {e}")
+        logger.error(f"Error extracting links from {index_url}: {e}")
         return []
 
+    logger.info(f"Found {len(game_links)} potential game links.")
+
+    if limit:
+        logger.info(f"Limiting to {limit} games.")
+        return game_links[:limit]
+    return game_links
+
 
 def sanitize_filename(name):
     """Removes invalid characters for Windows filenames."""
     if not name:
         return "_unknown_game_"
     # Remove invalid characters
-    name = re.sub(r'[<>:"/\\|?*]', '', name)
+    name = name.translate(_TRANS_TABLE)
     # Replace potential problematic sequences like '..'
-    name = re.sub(r'\.\.', '_', name)
+    name = _DOTDOT.sub('_', name)
     # Remove leading/trailing whitespace/dots
     name = name.strip('. ')
     # Replace spaces with underscores (optional, could also remove)
@@ -80,50 +284,345 @@ def sanitize_filename(name):
         return "_sanitized_empty_"
     return name
 
-def save_game_page_as_markdown(game_info, base_dir):
+def _name_key(name):
+    """Returns `name` as the file system compares it, so set lookups match what the OS would."""
+    return name.casefold() if CASE_INSENSITIVE_FS else name
+
+def _load_existing(base_dir):
+    """Maps each category subdirectory of base_dir to the set of Markdown filenames it holds (as _name_key)."""
+    existing = {}
+    for sub in os.scandir(base_dir):
+        if sub.is_dir():
+            existing[sub.name] = {_name_key(e.name) for e in os.scandir(sub.path) if e.name.endswith('.md')}
+    return existing
+
+def html_to_markdown(content_html_str):
+    """Converts a page's content HTML to Markdown. Runs in the MarkdownPool worker processes."""
+    return _MD.convert(content_html_str)
+
+
+class MarkdownPool:
+    """Converts HTML to Markdown in worker processes, as markdownify is pure Python and GIL-bound.
+
+    At most twice as many pages as there are processes are queued at once,
+    which caps the memory held by HTML waiting for conversion.
+    """
+
+    def __init__(self, processes=None):
+        processes = processes or os.cpu_count() or 1
+        # spawn behaves the same on every platform and is safe with the worker threads running
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        self._slots = asyncio.Semaphore(processes * 2)
+
+    async def convert(self, content_html_str):
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, html_to_markdown, content_html_str)
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+class _SQLiteStore:
+    """A SQLite connection in WAL mode whose writes are committed in batches of COMMIT_EVERY."""
+
+    COMMIT_EVERY = 100
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._uncommitted = 0
+
+    def _written(self):
+        """Counts one written row, committing once COMMIT_EVERY have accumulated."""
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+class Manifest(_SQLiteStore):
+    """Saved pages keyed by URL, with their path and cache validators, in SQLite.
+
+    Lets a resumed run tell which URLs are done without deriving filenames,
+    and keeps working when a game's title (and so its filename) changes.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, path TEXT)"
+        )
+        # One URL per path. Older runs could record two; the file holds the later write
+        self._conn.execute(
+            "DELETE FROM pages WHERE rowid NOT IN (SELECT max(rowid) FROM pages GROUP BY path)"
+        )
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS pages_path ON pages(path)")
+        self._conn.commit()
+        # Which URL holds each path, including paths claimed by fetches still in flight
+        self._owners = {_name_key(path): url for url, path in self._conn.execute("SELECT url, path FROM pages")}
+
+    def lookup(self, url):
+        """Returns (etag, last_modified, path) for a saved URL, or None."""
+        return self._conn.execute(
+            "SELECT etag, last_modified, path FROM pages WHERE url=?", (url,)
+        ).fetchone()
+
+    def claim(self, path, url):
+        """Reserves `path` for `url`; returns False if another URL already holds it.
+
+        Call before the first await so two concurrent games never share a file.
+        """
+        return self._owners.setdefault(_name_key(path), url) == url
+
+    def release(self, path, url):
+        """Gives up a claim that no record() followed, e.g. after a failed fetch."""
+        key = _name_key(path)
+        if self._owners.get(key) == url:
+            del self._owners[key]
+
+    def record(self, url, path, etag=None, last_modified=None):
+        """Stores a saved page; rows are committed in batches of COMMIT_EVERY."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO pages(url, etag, last_modified, path) VALUES (?, ?, ?, ?)",
+            (url, etag, last_modified, path),
+        )
+        self._owners[_name_key(path)] = url
+        self._written()
+
+
+class PageStore(_SQLiteStore):
+    """All pages in one SQLite database with an FTS5 full-text index (--format sqlite).
+
+    Replaces one .md file per game with a single database that is written
+    sequentially and can be searched directly, e.g.
+    SELECT title FROM pages_fts WHERE pages_fts MATCH 'boss'.
+    """
+
+    COMMIT_EVERY = 500
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.path = path
+        # The FTS index reads its text from `pages`; the triggers keep it in step
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages(
+                id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, title TEXT, category TEXT,
+                markdown TEXT, etag TEXT, last_modified TEXT);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts
+                USING fts5(title, markdown, content='pages', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS pages_ai AFTER INSERT ON pages BEGIN
+                INSERT INTO pages_fts(rowid, title, markdown) VALUES (new.id, new.title, new.markdown);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_ad AFTER DELETE ON pages BEGIN
+                INSERT INTO pages_fts(pages_fts, rowid, title, markdown) VALUES ('delete', old.id, old.title, old.markdown);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_au AFTER UPDATE ON pages BEGIN
+                INSERT INTO pages_fts(pages_fts, rowid, title, markdown) VALUES ('delete', old.id, old.title, old.markdown);
+                INSERT INTO pages_fts(rowid, title, markdown) VALUES (new.id, new.title, new.markdown);
+            END;
+        """)
+
+    def lookup(self, url):
+        """Returns (etag, last_modified) for a stored URL, or None."""
+        return self._conn.execute("SELECT etag, last_modified FROM pages WHERE url=?", (url,)).fetchone()
+
+    def add(self, url, title, category, markdown, etag=None, last_modified=None):
+        """Stores or replaces a page; rows are committed in batches of COMMIT_EVERY."""
+        # An upsert (not INSERT OR REPLACE) so the update trigger fires for the FTS index
+        self._conn.execute(
+            "INSERT INTO pages(url, title, category, markdown, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET title=excluded.title, category=excluded.category, "
+            "markdown=excluded.markdown, etag=excluded.etag, last_modified=excluded.last_modified",
+            (url, title, category, markdown, etag, last_modified),
+        )
+        self._written()
+
+
+async def fetch_game_markdown(session, game_info, md_pool, last_modified=None, etag=None, rate_limiter=None):
+    """Fetches a game page (conditionally, given validators) and converts its content to Markdown.
+
+    Returns:
+        tuple: (markdown_content, page_title, headers) where markdown_content is
+        None on a fetch error and NOT_MODIFIED if the page is unchanged.
+    """
+    original_title = game_info.get("title", "Unknown Title")
+    tree, response_headers = await fetch_html(session, game_info["url"], last_modified, etag, rate_limiter)
+    if tree is None or tree is NOT_MODIFIED:
+        return tree, original_title, None
+
+    # Extraction blocks, so it runs on the worker threads;
+    # the Markdown conversion itself fans out to the worker processes
+    page_title, content_html_str = await asyncio.to_thread(extract_page_content, tree, original_title)
+    if content_html_str is not None:
+        markdown_content = await md_pool.convert(content_html_str)
+    else:
+        logger.warning(f"Warning: Could not find main content area for '{page_title}'. Saving empty file.")
+        markdown_content = f"# {page_title}\n\nContent could not be extracted."
+    return markdown_content, page_title, response_headers
+
+
+async def save_game_page_as_markdown(session, game_info, base_dir, existing, manifest, md_pool, refresh=False, rate_limiter=None):
     """Fetches a game page, converts its content to Markdown, and saves it.
 
+    `existing` is the snapshot from _load_existing; saved files are added to it.
+    Pages recorded in `manifest` are found under their recorded path, other
+    pages by their filename. With `refresh`, already saved pages are re-fetched
+    conditionally and only rewritten if the server reports a change.
+
     Returns:
-        tuple: (success: bool, request_made: bool)
+        bool: True if the page was saved (or already was), False otherwise.
     """
     game_url = game_info["url"]
     original_title = game_info.get("title", "Unknown Title")
 
     # --- Pre-computation before checking existence ---
-    # Determine potential filename and path *before* fetching
-    # We need this to check if the file exists
-    # Try to get title from game_info first for filtering, fallback to placeholder
-    temp_page_title = original_title # Use title from index link initially
-    filename_safe_title = sanitize_filename(temp_page_title)
-
-    first_char = filename_safe_title[0].upper() if filename_safe_title else '_'
-    if '0' <= first_char <= '9':
-        target_subdir = '0-9'
-    elif 'A' <= first_char <= 'Z':
-        target_subdir = first_char
-    else:
-        target_subdir = '_'
+    # Filename and subdirectory were derived from the index link title in main,
+    # so the existence check needs no fetch and no second sanitization
+    filename_safe_title = game_info["safe_title"]
+    target_subdir = game_info["category"]
+
+    output_filename = f"{filename_safe_title}.md"
+
+    # A URL saved before keeps its recorded path, as long as that file is still there
+    etag = last_modified = None
+    record = manifest.lookup(game_url)
+    if record is not None:
+        recorded_subdir, _, recorded_filename = record[2].partition('/')
+        if _name_key(recorded_filename) in existing.get(recorded_subdir, ()):
+            etag, last_modified = record[0], record[1]
+            target_subdir, output_filename = recorded_subdir, recorded_filename
+        else:
+            record = None
 
     output_dir = os.path.join(base_dir, target_subdir)
-    output_filepath = os.path.join(output_dir, f"{filename_safe_title}.md")
+    output_filepath = os.path.join(output_dir, output_filename)
+    manifest_path = f"{target_subdir}/{output_filename}"
 
-    # Ensure the directory exists *before* checking the file
-    os.makedirs(output_dir, exist_ok=True)
+    # Another URL with the same sanitized title owns (or is fetching) this file; never overwrite it.
+    # Claimed before the first await, so concurrent games can't both pass this check
+    if not manifest.claim(manifest_path, game_url):
+        logger.warning(f"Skipping '{original_title}' ({game_url}), {output_filepath} already holds a different page.")
+        return True # Indicate success (nothing to do)
 
     # Check if file already exists to avoid re-scraping
-    if os.path.exists(output_filepath):
-        print(f"Skipping '{original_title}' ({game_url}), Markdown file already exists at {output_filepath}.")
-        return True, False # Indicate success (already done), and no request was made
+    already_saved = record is not None
+    if record is None and _name_key(output_filename) in existing.get(target_subdir, ()):
+        # Saved before the manifest existed: adopt the file for this URL
+        manifest.record(game_url, manifest_path)
+        already_saved = True
+    if already_saved and not refresh:
+        logger.info(f"Skipping '{original_title}' ({game_url}), Markdown file already exists at {output_filepath}.")
+        return True # Indicate success (already done)
+
+    # When refreshing, only ask for the page if it changed since we saved it
+    if already_saved and not (etag or last_modified):
+        try:
+            last_modified = formatdate(os.stat(output_filepath).st_mtime, usegmt=True)
+        except OSError:
+            pass
 
-    # --- If file doesn't exist, proceed with fetching --- 
-    print(f"Processing '{original_title}' ({game_url})...")
-    tree = fetch_html(game_url)
-    if tree is None:
-        print(f"Skipping {original_title} due to fetch error.")
-        return False, True # Indicate failure, but a request was attempted
+    # --- If file doesn't exist (or is being refreshed), proceed with fetching --- 
+    logger.info(f"Processing '{original_title}' ({game_url})...")
+    markdown_content, _, response_headers = await fetch_game_markdown(
+        session, game_info, md_pool, last_modified, etag, rate_limiter
+    )
+    if markdown_content is None:
+        logger.warning(f"Skipping {original_title} due to fetch error.")
+        if not already_saved:
+            manifest.release(manifest_path, game_url)
+        return False # Indicate failure
+    if markdown_content is NOT_MODIFIED:
+        logger.info(f"'{original_title}' is unchanged since it was saved, keeping {output_filepath}.")
+        return True # Indicate success (still current)
+    last_modified = response_headers.get('Last-Modified')
 
+    # --- Save Markdown File ---
+    try:
+        # Encode once and hand the whole document to a single write, off the event loop
+        await asyncio.to_thread(Path(output_filepath).write_bytes, markdown_content.encode('utf-8'))
+        existing.setdefault(target_subdir, set()).add(_name_key(output_filename))
+        manifest.record(game_url, manifest_path, response_headers.get('ETag'), last_modified)
+        logger.info(f"Saved: {output_filepath}")
+        # Match the file's mtime to the page so the next --refresh asks the right question
+        if last_modified:
+            try:
+                modified_ts = parsedate_to_datetime(last_modified).timestamp()
+                os.utime(output_filepath, (modified_ts, modified_ts))
+            except (TypeError, ValueError, OSError) as e:
+                logger.warning(f"Warning: Could not apply Last-Modified '{last_modified}' to {output_filepath}: {e}")
+        return True # Indicate success
+    except IOError as e:
+        logger.error(f"Error saving file {output_filepath}: {e}")
+        try:
+            os.remove(output_filepath)
+        except OSError:
+            pass
+        if not already_saved:
+            manifest.release(manifest_path, game_url)
+        return False # Indicate failure
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during file write for {output_filepath}: {e}")
+        if not already_saved:
+            manifest.release(manifest_path, game_url)
+        return False # Indicate failure
+
+
+async def save_game_page_to_database(session, game_info, page_store, md_pool, refresh=False, rate_limiter=None):
+    """Fetches a game page, converts its content to Markdown, and stores it in `page_store`.
+
+    With `refresh`, already stored pages are re-fetched conditionally and only
+    replaced if the server reports a change.
+
+    Returns:
+        bool: True if the page was saved (or already was), False otherwise.
+    """
+    game_url = game_info["url"]
+    original_title = game_info.get("title", "Unknown Title")
+
+    record = page_store.lookup(game_url)
+    if record is not None and not refresh:
+        logger.info(f"Skipping '{original_title}' ({game_url}), already stored in {page_store.path}.")
+        return True # Indicate success (already done)
+    etag, last_modified = record if record is not None else (None, None)
+
+    logger.info(f"Processing '{original_title}' ({game_url})...")
+    markdown_content, page_title, response_headers = await fetch_game_markdown(
+        session, game_info, md_pool, last_modified, etag, rate_limiter
+    )
+    if markdown_content is None:
+        logger.warning(f"Skipping {original_title} due to fetch error.")
+        return False # Indicate failure
+    if markdown_content is NOT_MODIFIED:
+        logger.info(f"'{original_title}' is unchanged since it was stored.")
+        return True # Indicate success (still current)
+
+    try:
+        page_store.add(
+            game_url, page_title, game_info["category"], markdown_content,
+            response_headers.get('ETag'), response_headers.get('Last-Modified'),
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Error storing '{page_title}' in {page_store.path}: {e}")
+        return False # Indicate failure
+    logger.info(f"Stored: '{page_title}' in {page_store.path}")
+    return True # Indicate success
+
+
+def extract_page_content(tree, original_title):
+    """Extracts the title and main content HTML of a parsed game page.
+
+    Returns:
+        tuple: (page_title: str, content_html_str: str or None if no content area was found)
+    """
     # --- Extract Actual Title and Content --- (Now we have the page)
-    title_element = tree.xpath('//h1[@id="firstHeading"]/span/text()')
+    title_element = _XP_TITLE(tree)
     page_title = title_element[0].strip() if title_element else original_title
 
     # Re-sanitize using the *actual* page title if different from the link title
@@ -134,49 +633,67 @@ def save_game_page_as_markdown(game_info, base_dir):
     # filename_safe_title = sanitize_filename(page_title)
     # output_filepath = os.path.join(output_dir, f"{filename_safe_title}.md")
 
-    print(f"Actual page title: '{page_title}'") # Log the title found on the page
+    logger.info(f"Actual page title: '{page_title}'") # Log the title found on the page
 
-    # --- Convert Content to Markdown --- 
-    content_elements = tree.xpath('//div[@id="mw-content-text"]/div[contains(@class, "mw-parser-output")]')
+    # --- Locate Content for Markdown Conversion --- 
+    content_elements = _XP_CONTENT(tree)
     if not content_elements:
-         content_elements = tree.xpath('//div[@id="mw-content-text"]')
+         content_elements = _XP_CONTENT_FALLBACK(tree)
 
-    if content_elements:
-        content_html_bytes = html.tostring(content_elements[0], encoding='utf-8')
-        content_html_str = content_html_bytes.decode('utf-8')
-        markdown_content = markdownify(content_html_str, heading_style="ATX")
-    else:
-        print(f"Warning: Could not find main content area for '{page_title}'. Saving empty file.")
-        markdown_content = f"# {page_title}\n\nContent could not be extracted."
+    if not content_elements:
+        return page_title, None
+    content = content_elements[0]
 
-    # --- Save Markdown File ---
-    try:
-        with open(output_filepath, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
-        print(f"Saved: {output_filepath}")
-        return True, True # Indicate success, and a request was made
-    except IOError as e:
-        print(f"Error saving file {output_filepath}: {e}")
-        try:
-            os.remove(output_filepath)
-        except OSError:
-            pass
-        return False, True # Indicate failure, request was made
-    except Exception as e:
-        print(f"An unexpected error occurred during file write for {output_filepath}: {e}")
-        return False, True # Indicate failure, request was made
+    # Prune in lxml, so markdownify has less HTML to walk; drop_tree() keeps the tail text
+    for element in _XP_NON_CONTENT(content):
+        element.drop_tree()
+
+    # Serialize straight to str; no bytes round-trip before markdownify
+    return page_title, html.tostring(content, encoding='unicode')
 
 
-def main():
+async def process_game(sem, save_page, game_info, position, total_games):
+    """Runs one game through `save_page` (a bound save function) inside a concurrency slot.
+
+    Returns:
+        bool: True if the game was saved (or already existed), False otherwise.
+    """
+    async with sem:
+        logger.info(f"\n--- Processing game {position}/{total_games} ---")
+        # Politeness delays come from the shared rate limiter, so skipped games cost no time
+        return await save_page(game_info)
+
+
+async def _flush_logs_periodically(handler, interval=1.0):
+    """Flushes buffered log records at least every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        handler.flush()
+
+
+async def main():
     parser = argparse.ArgumentParser(description="Scrape game pages from beforeiplay.com and save as Markdown.")
     parser.add_argument("--limit", type=int, help="Limit the number of game pages to process (for testing).")
     parser.add_argument("--output-dir", default="scraped_games", help="Directory to save the markdown files.")
+    parser.add_argument("--format", choices=["markdown", "sqlite"], default="markdown", help=f"Save one .md file per game (default), or all games in a single searchable SQLite database ({PAGE_STORE_FILENAME}) in the output directory.")
     parser.add_argument("--delay", type=float, default=1.0, help="Delay in seconds between requests (default: 1.0).")
     parser.add_argument("--randomize-delay", action='store_true', help="Randomize delay slightly to mimic human behavior.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of game pages fetched concurrently (default: 4).")
+    parser.add_argument("--workers", type=int, default=16, help="Number of threads for parsing, content extraction and file writes (default: 16). Markdown conversion uses one process per CPU.")
+    parser.add_argument("--refresh", action='store_true', help="Re-check already saved pages and re-download only those changed since they were saved.")
     parser.add_argument("-l", "--letter", type=str, help="Only process games starting with this letter (e.g., 'A', 'B', or '0' for '0-9'). Case-insensitive.")
 
     args = parser.parse_args()
 
+    # Buffer log lines and write them to stdout in batches: when 64 records are
+    # queued, on any error, or at least once a second (see below).
+    # A single handler also keeps lines from concurrent games from interleaving.
+    # The format goes on the stream handler: it is the one that formats flushed records
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    log_handler = logging.handlers.MemoryHandler(capacity=64, target=stream_handler)
+    logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+
     # Normalize the letter argument
     target_letter_category = None
     if args.letter:
@@ -188,40 +705,64 @@ def main():
         elif len(args.letter) == 1: # Handle symbols/other edge cases
             target_letter_category = '_'
         else:
-            print(f"Warning: Invalid letter specified ('{args.letter}'). Processing all games.")
+            logger.warning(f"Warning: Invalid letter specified ('{args.letter}'). Processing all games.")
+
+    if args.concurrency < 1:
+        logger.warning(f"Warning: Invalid concurrency ({args.concurrency}). Using 1.")
+        args.concurrency = 1
+    if args.workers < 1:
+        logger.warning(f"Warning: Invalid worker count ({args.workers}). Using 1.")
+        args.workers = 1
 
-    print(f"Starting scraper. Output directory: '{args.output_dir}', Limit: {args.limit}, Delay: {args.delay}s")
+    logger.info(f"Starting scraper. Output directory: '{args.output_dir}', Limit: {args.limit}, Delay: {args.delay}s, Concurrency: {args.concurrency}, Workers: {args.workers}")
     if target_letter_category:
-        print(f"Filtering for letter/category: '{target_letter_category}'")
+        logger.info(f"Filtering for letter/category: '{target_letter_category}'")
     os.makedirs(args.output_dir, exist_ok=True)
 
+    # asyncio.to_thread() dispatches the blocking work to the loop's default executor
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.workers))
+
+    # One session (and connection pool) for the whole run
+    connector = aiohttp.TCPConnector(limit_per_host=8, limit=64)
+    # Per connect/read like requests' timeout=30, not a cap on the whole download
+    timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=30)
+    # One request per --delay seconds across all workers, after an initial burst of --concurrency
+    rate_limiter = TokenBucket(1 / args.delay, args.concurrency, args.randomize_delay) if args.delay > 0 else None
+    md_pool = MarkdownPool()
+    log_flusher = asyncio.create_task(_flush_logs_periodically(log_handler))
+    try:
+        async with aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout) as session:
+            await scrape(session, md_pool, rate_limiter, args, target_letter_category)
+    finally:
+        md_pool.shutdown()
+        log_flusher.cancel()
+        log_handler.flush()
+
+
+async def scrape(session, md_pool, rate_limiter, args, target_letter_category):
+    """Fetches the game index, applies the filters and processes the remaining games."""
     # Get all links first, then filter if needed
-    all_game_links = get_game_links(INDEX_URL, None) # Fetch all initially, limit applied later
+    all_game_links = await get_game_links(session, INDEX_URL, None, rate_limiter) # Fetch all initially, limit applied later
 
     if not all_game_links:
-        print("No game links found or error fetching index. Exiting.")
+        logger.info("No game links found or error fetching index. Exiting.")
         return
 
+    # Derive the filename and category bucket once per game; saving reuses them
+    for game_info in all_game_links:
+        original_title = game_info.get("title", "Unknown Title")
+        filename_safe_title = sanitize_filename(original_title)
+
+        first_code = ord(filename_safe_title[0])
+        current_category = _BUCKET[first_code] if first_code < 128 else '_'
+
+        game_info['safe_title'] = filename_safe_title
+        game_info['category'] = current_category
+
     # Filter based on the letter argument
     if target_letter_category:
-        filtered_links = []
-        for game_info in all_game_links:
-            original_title = game_info.get("title", "Unknown Title")
-            filename_safe_title = sanitize_filename(original_title)
-            if not filename_safe_title: continue # Skip if sanitization failed badly
-
-            first_char = filename_safe_title[0].upper()
-            current_category = ''
-            if '0' <= first_char <= '9':
-                current_category = '0-9'
-            elif 'A' <= first_char <= 'Z':
-                current_category = first_char
-            else:
-                current_category = '_'
-
-            if current_category == target_letter_category:
-                filtered_links.append(game_info)
-        print(f"Filtered down to {len(filtered_links)} games for category '{target_letter_category}'.")
+        filtered_links = [game_info for game_info in all_game_links if game_info['category'] == target_letter_category]
+        logger.info(f"Filtered down to {len(filtered_links)} games for category '{target_letter_category}'.")
         game_links_to_process = filtered_links
     else:
         game_links_to_process = all_game_links
@@ -229,44 +770,69 @@ def main():
     # Apply the limit *after* filtering by letter if applicable
     if args.limit is not None:
          if len(game_links_to_process) > args.limit:
-             print(f"Applying limit: processing first {args.limit} of {len(game_links_to_process)} games.")
+             logger.info(f"Applying limit: processing first {args.limit} of {len(game_links_to_process)} games.")
              game_links_to_process = game_links_to_process[:args.limit]
          else:
-             print(f"Limit ({args.limit}) is >= number of games ({len(game_links_to_process)}), processing all.")
+             logger.info(f"Limit ({args.limit}) is >= number of games ({len(game_links_to_process)}), processing all.")
 
 
     if not game_links_to_process:
-         print("No games match the specified criteria after filtering. Exiting.")
+         logger.info("No games match the specified criteria after filtering. Exiting.")
          return
 
     processed_count = 0
     error_count = 0
     total_games = len(game_links_to_process) # Use the count of the list we'll iterate over
 
-    print(f"Beginning processing for {total_games} games...")
+    logger.info(f"Beginning processing for {total_games} games...")
+
+    if args.format == 'sqlite':
+        store = PageStore(os.path.join(args.output_dir, PAGE_STORE_FILENAME))
+        save_page = functools.partial(
+            save_game_page_to_database, session,
+            page_store=store, md_pool=md_pool, refresh=args.refresh, rate_limiter=rate_limiter,
+        )
+        output_location = store.path
+    else:
+        # Create the few category subdirectories once, rather than once per game
+        for category in {game_info['category'] for game_info in game_links_to_process}:
+            os.makedirs(os.path.join(args.output_dir, category), exist_ok=True)
+
+        # One directory scan up front instead of a stat() per game
+        existing = _load_existing(args.output_dir)
 
-    for i, game_info in enumerate(game_links_to_process):
-        print(f"\n--- Processing game {i+1}/{total_games} ---")
-        success, request_made = save_game_page_as_markdown(game_info, args.output_dir)
-        if success:
+        store = Manifest(os.path.join(args.output_dir, MANIFEST_FILENAME))
+        save_page = functools.partial(
+            save_game_page_as_markdown, session,
+            base_dir=args.output_dir, existing=existing, manifest=store, md_pool=md_pool,
+            refresh=args.refresh, rate_limiter=rate_limiter,
+        )
+        output_location = args.output_dir
+
+    try:
+        sem = asyncio.Semaphore(args.concurrency)
+        tasks = [
+            asyncio.create_task(process_game(sem, save_page, game_info, i + 1, total_games))
+            for i, game_info in enumerate(game_links_to_process)
+        ]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        store.close()
+
+    for game_info, result in zip(game_links_to_process, results):
+        if isinstance(result, Exception):
+            logger.error(f"Unexpected error while processing '{game_info.get('title', 'Unknown Title')}': {result}")
+            error_count += 1
+        elif result:
             processed_count += 1
         else:
             error_count += 1
 
-        # Respectful delay ONLY if a request was actually made
-        if request_made and (i < total_games - 1):
-            delay = args.delay
-            if args.randomize_delay:
-                delay = random.uniform(delay * 0.5, delay * 1.5)
-            print(f"Waiting for {delay:.2f} seconds before next request...")
-            time.sleep(delay)
-
-
-    print(f"\n--- Scraping complete ---")
-    print(f"Successfully processed: {processed_count} games")
-    print(f"Errors encountered: {error_count} games")
-    print(f"Markdown files saved in: '{args.output_dir}'")
+    logger.info(f"\n--- Scraping complete ---")
+    logger.info(f"Successfully processed: {processed_count} games")
+    logger.info(f"Errors encountered: {error_count} games")
+    logger.info(f"Markdown saved in: '{output_location}'")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())